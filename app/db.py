@@ -1,186 +1,305 @@
 from __future__ import annotations
+import logging
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 DB_PATH = Path(__file__).resolve().parent.parent / "och_shiftkun.db"
 
+logger = logging.getLogger(__name__)
 
-def get_conn() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+# journal_mode=WAL is persistent in the DB file, so it only needs to be set once
+_PRAGMAS_APPLIED = False
+
+# One long-lived connection per thread (sqlite3 connections must not be shared across threads)
+_local = threading.local()
+
+
+def _apply_pragmas(conn: sqlite3.Connection) -> None:
+    global _PRAGMAS_APPLIED
+    if not _PRAGMAS_APPLIED:
+        conn.execute("PRAGMA journal_mode=WAL")
+        _PRAGMAS_APPLIED = True
+    # Per-connection settings
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-64000")
+    conn.execute("PRAGMA busy_timeout=5000")
+
+
+def _connect(**kwargs: Any) -> sqlite3.Connection:
+    # Autocommit: reads run without the module's implicit BEGIN; writes go through transaction()
+    conn = sqlite3.connect(DB_PATH, isolation_level=None, **kwargs)
     conn.row_factory = sqlite3.Row
+    _apply_pragmas(conn)
     return conn
 
 
-def init_db() -> None:
+def get_conn() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _connect()
+        _local.conn = conn
+    return conn
+
+
+@contextmanager
+def transaction() -> Iterator[sqlite3.Connection]:
+    # Commits once on success and rolls back on error. Nested use (e.g. write helpers
+    # called inside a caller's transaction()) joins the outer transaction.
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS requests (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            month TEXT NOT NULL,
-            doctor TEXT NOT NULL,
-            request_text TEXT NOT NULL,
-            created_at TEXT NOT NULL
+    if getattr(_local, "on_exit", None) is not None:
+        yield conn
+        return
+    _local.on_exit = []
+    try:
+        # IMMEDIATE takes the write lock up front, so contention waits on busy_timeout
+        # instead of failing when a deferred transaction tries to upgrade
+        conn.execute("BEGIN IMMEDIATE")
+        with conn:
+            yield conn
+    finally:
+        callbacks, _local.on_exit = _local.on_exit, None
+        for callback in callbacks:
+            callback()
+
+
+def _after_transaction(callback: Callable[[], None]) -> None:
+    # Run once the enclosing transaction has committed or rolled back
+    _local.on_exit.append(callback)
+
+
+# Statements are module constants so each thread's connection reuses its prepared statement cache
+_SQL_INSERT_REQUEST = "INSERT INTO requests (month, doctor, request_text, created_at) VALUES (?, ?, ?, ?)"
+_SQL_LIST_REQUESTS = (
+    "SELECT id, doctor, request_text, created_at FROM requests WHERE month=? ORDER BY created_at ASC"
+)
+_SQL_LIST_REQUESTS_BY_DOCTOR = (
+    "SELECT id, doctor, request_text, created_at FROM requests WHERE month=? AND doctor=? ORDER BY created_at ASC"
+)
+# Per-doctor count of "出張" in request text, ignoring anything after the "/ 備考:" note separator
+_SQL_TRAVEL_COUNTS_FROM_REQUESTS = (
+    "SELECT doctor, SUM((length(head) - length(replace(head, '出張', ''))) / length('出張')) AS travel "
+    "FROM (SELECT doctor, CASE WHEN instr(request_text, '/ 備考:') > 0 "
+    "THEN substr(request_text, 1, instr(request_text, '/ 備考:') - 1) ELSE request_text END AS head "
+    "FROM requests WHERE month=?) GROUP BY doctor"
+)
+_SQL_DELETE_REQUEST = "DELETE FROM requests WHERE id=?"
+_SQL_INSERT_TRAVEL = "INSERT INTO travel (month, doctor, days, dates_text, created_at) VALUES (?, ?, ?, ?, ?)"
+_SQL_UPSERT_TRAVEL = (
+    _SQL_INSERT_TRAVEL + " ON CONFLICT(month, doctor) DO UPDATE SET "
+    "days=excluded.days, dates_text=excluded.dates_text, created_at=excluded.created_at"
+)
+_SQL_LIST_TRAVEL = "SELECT doctor, days, dates_text, created_at FROM travel WHERE month=? ORDER BY doctor ASC"
+_SQL_GET_TRAVEL = "SELECT doctor, days, dates_text, created_at FROM travel WHERE month=? AND doctor=?"
+_SQL_GET_CONFIG = "SELECT key, value FROM config"
+_SQL_INSERT_CONFIG = "INSERT INTO config (key, value) VALUES (?, ?)"
+_SQL_UPSERT_CONFIG = _SQL_INSERT_CONFIG + " ON CONFLICT(key) DO UPDATE SET value=excluded.value"
+_SQL_INSERT_CONFIG_HISTORY = (
+    "INSERT INTO config_history (created_at, editor, staff_list, base_rules, individual_rules, additional_rules) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+_SQL_LIST_CONFIG_HISTORY = (
+    "SELECT created_at, editor, staff_list, base_rules, individual_rules, additional_rules "
+    "FROM config_history ORDER BY id DESC"
+)
+_SQL_LIST_CONFIG_HISTORY_LIMIT = _SQL_LIST_CONFIG_HISTORY + " LIMIT ?"
+_SQL_INSERT_SCHEDULE = (
+    "INSERT INTO schedules (month, status, table_text, counts_text, change_log, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+_SQL_UPSERT_SCHEDULE = (
+    "INSERT INTO schedules (month, status, table_text, counts_text, counts_json, change_log, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(month, status) DO UPDATE SET "
+    "table_text=excluded.table_text, counts_text=excluded.counts_text, counts_json=excluded.counts_json, "
+    "change_log=excluded.change_log, created_at=excluded.created_at"
+)
+_SQL_GET_SCHEDULES_FOR_MONTH = (
+    "SELECT month, status, table_text, counts_text, counts_json, change_log, created_at "
+    "FROM schedules WHERE month=? AND status IN ('draft', 'final')"
+)
+_SQL_GET_DISPLAY_SCHEDULE = (
+    "SELECT month, status, table_text, counts_text, counts_json, change_log, created_at "
+    "FROM schedules WHERE month=? ORDER BY CASE status WHEN 'final' THEN 0 ELSE 1 END, created_at DESC LIMIT 1"
+)
+
+
+def init_db() -> None:
+    with transaction() as conn:
+        cur = conn.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS requests (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                month TEXT NOT NULL,
+                doctor TEXT NOT NULL,
+                request_text TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
         )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS schedules (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            month TEXT NOT NULL,
-            status TEXT NOT NULL DEFAULT 'draft',
-            table_text TEXT NOT NULL,
-            counts_text TEXT NOT NULL,
-            change_log TEXT NOT NULL,
-            created_at TEXT NOT NULL
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                month TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'draft',
+                table_text TEXT NOT NULL,
+                counts_text TEXT NOT NULL,
+                change_log TEXT NOT NULL,
+                created_at TEXT NOT NULL
+            )
+            """
         )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS travel (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            month TEXT NOT NULL,
-            doctor TEXT NOT NULL,
-            days INTEGER,
-            dates_text TEXT,
-            created_at TEXT NOT NULL,
-            UNIQUE(month, doctor)
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS travel (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                month TEXT NOT NULL,
+                doctor TEXT NOT NULL,
+                days INTEGER,
+                dates_text TEXT,
+                created_at TEXT NOT NULL,
+                UNIQUE(month, doctor)
+            )
+            """
         )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS config (
-            key TEXT PRIMARY KEY,
-            value TEXT NOT NULL
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS config (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            )
+            """
         )
-        """
-    )
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS config_history (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            created_at TEXT NOT NULL,
-            editor TEXT NOT NULL,
-            staff_list TEXT NOT NULL,
-            base_rules TEXT NOT NULL,
-            individual_rules TEXT NOT NULL,
-            additional_rules TEXT NOT NULL
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS config_history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                created_at TEXT NOT NULL,
+                editor TEXT NOT NULL,
+                staff_list TEXT NOT NULL,
+                base_rules TEXT NOT NULL,
+                individual_rules TEXT NOT NULL,
+                additional_rules TEXT NOT NULL
+            )
+            """
         )
-        """
-    )
-    try:
-        cur.execute("ALTER TABLE config_history ADD COLUMN editor TEXT NOT NULL DEFAULT 'unknown'")
-    except sqlite3.OperationalError:
-        pass
-    # Lightweight migration for existing DBs
-    try:
-        cur.execute("ALTER TABLE schedules ADD COLUMN status TEXT NOT NULL DEFAULT 'draft'")
-    except sqlite3.OperationalError:
-        pass
-    conn.commit()
-    conn.close()
+        try:
+            cur.execute("ALTER TABLE config_history ADD COLUMN editor TEXT NOT NULL DEFAULT 'unknown'")
+        except sqlite3.OperationalError:
+            pass
+        # Lightweight migration for existing DBs
+        try:
+            cur.execute("ALTER TABLE schedules ADD COLUMN status TEXT NOT NULL DEFAULT 'draft'")
+        except sqlite3.OperationalError:
+            pass
+        # Parsed counts_text; NULL for rows saved before this column existed or restored from backup
+        try:
+            cur.execute("ALTER TABLE schedules ADD COLUMN counts_json TEXT")
+        except sqlite3.OperationalError:
+            pass
+        # Indexes for the per-month lookups (travel is already covered by UNIQUE(month, doctor))
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_requests_month_created ON requests (month, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_requests_month_doctor ON requests (month, doctor, created_at)")
+        # One row per (month, status) so upsert_schedule can use ON CONFLICT; drop stray duplicates first
+        cur.execute(
+            "DELETE FROM schedules WHERE id NOT IN (SELECT MIN(id) FROM schedules GROUP BY month, status)"
+        )
+        if cur.rowcount > 0:
+            logger.warning("Removed %d duplicate schedule rows (same month and status)", cur.rowcount)
+        # Superseded by the unique index below
+        cur.execute("DROP INDEX IF EXISTS idx_schedules_month_status")
+        # Served the removed latest-schedule lookup; per-month reads use the unique index
+        cur.execute("DROP INDEX IF EXISTS idx_schedules_month_created")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS uq_schedules_month_status ON schedules (month, status)")
 
 
 def add_request(month: str, doctor: str, request_text: str, created_at: str) -> None:
+    with transaction() as conn:
+        conn.execute(_SQL_INSERT_REQUEST, (month, doctor, request_text, created_at))
+
+
+def list_requests(month: str) -> List[sqlite3.Row]:
     conn = get_conn()
-    conn.execute(
-        "INSERT INTO requests (month, doctor, request_text, created_at) VALUES (?, ?, ?, ?)",
-        (month, doctor, request_text, created_at),
-    )
-    conn.commit()
-    conn.close()
+    return conn.execute(_SQL_LIST_REQUESTS, (month,)).fetchall()
 
 
-def list_requests(month: str) -> List[Dict[str, Any]]:
+def iter_requests(month: str) -> Iterator[sqlite3.Row]:
+    # Own connection: a streaming response may resume this generator on another thread
+    conn = _connect(check_same_thread=False)
+    try:
+        yield from conn.execute(_SQL_LIST_REQUESTS, (month,))
+    finally:
+        conn.close()
+
+
+def list_requests_by_doctor(month: str, doctor: str) -> List[sqlite3.Row]:
     conn = get_conn()
-    rows = conn.execute(
-        "SELECT id, doctor, request_text, created_at FROM requests WHERE month=? ORDER BY created_at ASC",
-        (month,),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    return conn.execute(_SQL_LIST_REQUESTS_BY_DOCTOR, (month, doctor)).fetchall()
 
 
-def list_requests_by_doctor(month: str, doctor: str) -> List[Dict[str, Any]]:
+def travel_counts_from_requests(month: str) -> Dict[str, int]:
     conn = get_conn()
-    rows = conn.execute(
-        "SELECT id, doctor, request_text, created_at FROM requests WHERE month=? AND doctor=? ORDER BY created_at ASC",
-        (month, doctor),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    return {r["doctor"]: r["travel"] for r in conn.execute(_SQL_TRAVEL_COUNTS_FROM_REQUESTS, (month,))}
 
 
 def delete_request(request_id: int) -> None:
-    conn = get_conn()
-    conn.execute("DELETE FROM requests WHERE id=?", (request_id,))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(_SQL_DELETE_REQUEST, (request_id,))
 
 
 def upsert_travel(month: str, doctor: str, days: int | None, dates_text: str | None, created_at: str) -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    existing = cur.execute(
-        "SELECT id FROM travel WHERE month=? AND doctor=?",
-        (month, doctor),
-    ).fetchone()
-    if existing:
-        cur.execute(
-            "UPDATE travel SET days=?, dates_text=?, created_at=? WHERE month=? AND doctor=?",
-            (days, dates_text, created_at, month, doctor),
-        )
-    else:
-        cur.execute(
-            "INSERT INTO travel (month, doctor, days, dates_text, created_at) VALUES (?, ?, ?, ?, ?)",
-            (month, doctor, days, dates_text, created_at),
-        )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(_SQL_UPSERT_TRAVEL, (month, doctor, days, dates_text, created_at))
 
 
-def list_travel(month: str) -> List[Dict[str, Any]]:
+def list_travel(month: str) -> List[sqlite3.Row]:
     conn = get_conn()
-    rows = conn.execute(
-        "SELECT doctor, days, dates_text, created_at FROM travel WHERE month=? ORDER BY doctor ASC",
-        (month,),
-    ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+    return conn.execute(_SQL_LIST_TRAVEL, (month,)).fetchall()
 
 
 def get_travel(month: str, doctor: str) -> Dict[str, Any] | None:
     conn = get_conn()
-    row = conn.execute(
-        "SELECT doctor, days, dates_text, created_at FROM travel WHERE month=? AND doctor=?",
-        (month, doctor),
-    ).fetchone()
-    conn.close()
+    row = conn.execute(_SQL_GET_TRAVEL, (month, doctor)).fetchone()
     return dict(row) if row else None
 
 
+# get_config_map result under "map"; the dict is swapped out whenever the config table changes
+_config_cache: Dict[str, Dict[str, Dict[str, str]]] = {"data": {}}
+
+
+def _invalidate_config_cache() -> None:
+    _config_cache["data"] = {}
+
+
 def get_config_map() -> Dict[str, str]:
+    # Callers get the shared cached dict and must treat it as read-only
+    cache = _config_cache["data"]
+    if "map" in cache:
+        return cache["map"]
     conn = get_conn()
-    rows = conn.execute("SELECT key, value FROM config").fetchall()
-    conn.close()
-    return {r["key"]: r["value"] for r in rows}
+    rows = conn.execute(_SQL_GET_CONFIG).fetchall()
+    data = {r["key"]: r["value"] for r in rows}
+    cache["map"] = data
+    return data
 
 
 def set_config_map(data: Dict[str, str]) -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    for key, value in data.items():
-        cur.execute(
-            "INSERT INTO config (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value),
-        )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.executemany(_SQL_UPSERT_CONFIG, data.items())
+        _after_transaction(_invalidate_config_cache)
+
+
+# list_config_history results by limit; the dict is swapped out whenever config_history changes
+_history_cache: Dict[str, Dict[Optional[int], List[sqlite3.Row]]] = {"data": {}}
+
+
+def _invalidate_history_cache() -> None:
+    _history_cache["data"] = {}
 
 
 def add_config_history(
@@ -191,31 +310,26 @@ def add_config_history(
     created_at: str,
     editor: str,
 ) -> None:
-    conn = get_conn()
-    conn.execute(
-        "INSERT INTO config_history (created_at, editor, staff_list, base_rules, individual_rules, additional_rules) "
-        "VALUES (?, ?, ?, ?, ?, ?)",
-        (created_at, editor, staff_list, base_rules, individual_rules, additional_rules),
-    )
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute(
+            _SQL_INSERT_CONFIG_HISTORY,
+            (created_at, editor, staff_list, base_rules, individual_rules, additional_rules),
+        )
+        _after_transaction(_invalidate_history_cache)
 
 
-def list_config_history(limit: int | None = 10) -> List[Dict[str, Any]]:
+def list_config_history(limit: int | None = 10) -> List[sqlite3.Row]:
+    # Bind the current cache first so a result read before an invalidation lands in the discarded dict
+    cache = _history_cache["data"]
+    if limit in cache:
+        return cache[limit]
     conn = get_conn()
     if limit is None:
-        rows = conn.execute(
-            "SELECT created_at, editor, staff_list, base_rules, individual_rules, additional_rules "
-            "FROM config_history ORDER BY id DESC"
-        ).fetchall()
+        rows = conn.execute(_SQL_LIST_CONFIG_HISTORY).fetchall()
     else:
-        rows = conn.execute(
-            "SELECT created_at, editor, staff_list, base_rules, individual_rules, additional_rules "
-            "FROM config_history ORDER BY id DESC LIMIT ?",
-            (limit,),
-        ).fetchall()
-    conn.close()
-    return [dict(r) for r in rows]
+        rows = conn.execute(_SQL_LIST_CONFIG_HISTORY_LIMIT, (limit,)).fetchall()
+    cache[limit] = rows
+    return rows
 
 
 def upsert_schedule(
@@ -225,142 +339,128 @@ def upsert_schedule(
     counts_text: str,
     change_log: str,
     created_at: str,
+    counts_json: str | None = None,
 ) -> None:
-    conn = get_conn()
-    cur = conn.cursor()
-    existing = cur.execute(
-        "SELECT id FROM schedules WHERE month=? AND status=?",
-        (month, status),
-    ).fetchone()
-    if existing:
-        cur.execute(
-            "UPDATE schedules SET table_text=?, counts_text=?, change_log=?, created_at=? WHERE month=? AND status=?",
-            (table_text, counts_text, change_log, created_at, month, status),
+    with transaction() as conn:
+        conn.execute(
+            _SQL_UPSERT_SCHEDULE,
+            (month, status, table_text, counts_text, counts_json, change_log, created_at),
         )
-    else:
-        cur.execute(
-            "INSERT INTO schedules (month, status, table_text, counts_text, change_log, created_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (month, status, table_text, counts_text, change_log, created_at),
-        )
-    conn.commit()
-    conn.close()
 
 
-def get_schedule(month: str, status: str) -> Optional[Dict[str, Any]]:
+def get_schedules_for_month(month: str) -> Dict[str, Dict[str, Any]]:
+    # {"draft": {...}, "final": {...}} with missing statuses left out
     conn = get_conn()
-    row = conn.execute(
-        "SELECT month, status, table_text, counts_text, change_log, created_at FROM schedules WHERE month=? AND status=?",
-        (month, status),
-    ).fetchone()
-    conn.close()
-    return dict(row) if row else None
+    return {r["status"]: dict(r) for r in conn.execute(_SQL_GET_SCHEDULES_FOR_MONTH, (month,))}
 
 
-def get_latest_schedule(month: str) -> Optional[Dict[str, Any]]:
+def get_display_schedule(month: str) -> Optional[Dict[str, Any]]:
+    # The month's final schedule if there is one, otherwise its most recently created row
     conn = get_conn()
-    row = conn.execute(
-        "SELECT month, status, table_text, counts_text, change_log, created_at "
-        "FROM schedules WHERE month=? ORDER BY created_at DESC LIMIT 1",
-        (month,),
-    ).fetchone()
-    conn.close()
+    row = conn.execute(_SQL_GET_DISPLAY_SCHEDULE, (month,)).fetchone()
     return dict(row) if row else None
 
 
-def export_all() -> Dict[str, Any]:
-    conn = get_conn()
-    data = {
-        "requests": [
-            dict(r)
-            for r in conn.execute(
-                "SELECT id, month, doctor, request_text, created_at FROM requests ORDER BY id ASC"
-            ).fetchall()
-        ],
-        "schedules": [
-            dict(r)
-            for r in conn.execute(
-                "SELECT id, month, status, table_text, counts_text, change_log, created_at FROM schedules ORDER BY id ASC"
-            ).fetchall()
-        ],
-        "travel": [
-            dict(r)
-            for r in conn.execute(
-                "SELECT id, month, doctor, days, dates_text, created_at FROM travel ORDER BY id ASC"
-            ).fetchall()
-        ],
-        "config": [
-            dict(r)
-            for r in conn.execute(
-                "SELECT key, value FROM config ORDER BY key ASC"
-            ).fetchall()
-        ],
-        "config_history": [
-            dict(r)
-            for r in conn.execute(
-                "SELECT id, created_at, editor, staff_list, base_rules, individual_rules, additional_rules "
-                "FROM config_history ORDER BY id ASC"
-            ).fetchall()
-        ],
-    }
-    conn.close()
-    return data
+_EXPORT_QUERIES = {
+    "requests": "SELECT id, month, doctor, request_text, created_at FROM requests ORDER BY id ASC",
+    "schedules": (
+        "SELECT id, month, status, table_text, counts_text, change_log, created_at FROM schedules ORDER BY id ASC"
+    ),
+    "travel": "SELECT id, month, doctor, days, dates_text, created_at FROM travel ORDER BY id ASC",
+    "config": "SELECT key, value FROM config ORDER BY key ASC",
+    "config_history": (
+        "SELECT id, created_at, editor, staff_list, base_rules, individual_rules, additional_rules "
+        "FROM config_history ORDER BY id ASC"
+    ),
+}
+
+
+def iter_export() -> Iterator[Tuple[str, Iterator[sqlite3.Row]]]:
+    # Own connection for streaming (see iter_requests); the read transaction
+    # gives every table the same snapshot and is rolled back by close()
+    conn = _connect(check_same_thread=False)
+    try:
+        conn.execute("BEGIN")
+        for name, sql in _EXPORT_QUERIES.items():
+            yield name, conn.execute(sql)
+    finally:
+        conn.close()
 
 
 def restore_all(data: Dict[str, Any]) -> None:
     conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("DELETE FROM requests")
-    cur.execute("DELETE FROM schedules")
-    cur.execute("DELETE FROM travel")
-    cur.execute("DELETE FROM config")
-    cur.execute("DELETE FROM config_history")
-
-    for r in data.get("requests", []):
-        cur.execute(
-            "INSERT INTO requests (month, doctor, request_text, created_at) VALUES (?, ?, ?, ?)",
-            (r.get("month", ""), r.get("doctor", ""), r.get("request_text", ""), r.get("created_at", "")),
-        )
-    for s in data.get("schedules", []):
-        cur.execute(
-            "INSERT INTO schedules (month, status, table_text, counts_text, change_log, created_at) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (
-                s.get("month", ""),
-                s.get("status", "draft"),
-                s.get("table_text", ""),
-                s.get("counts_text", ""),
-                s.get("change_log", ""),
-                s.get("created_at", ""),
-            ),
-        )
-    for t in data.get("travel", []):
-        cur.execute(
-            "INSERT INTO travel (month, doctor, days, dates_text, created_at) VALUES (?, ?, ?, ?, ?)",
-            (
-                t.get("month", ""),
-                t.get("doctor", ""),
-                t.get("days"),
-                t.get("dates_text"),
-                t.get("created_at", ""),
-            ),
-        )
-    for c in data.get("config", []):
-        cur.execute(
-            "INSERT INTO config (key, value) VALUES (?, ?)",
-            (c.get("key", ""), c.get("value", "")),
-        )
-    for h in data.get("config_history", []):
-        cur.execute(
-            "INSERT INTO config_history (created_at, editor, staff_list, base_rules, individual_rules, additional_rules) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (
-                h.get("created_at", ""),
-                h.get("editor", ""),
-                h.get("staff_list", ""),
-                h.get("base_rules", ""),
-                h.get("individual_rules", ""),
-                h.get("additional_rules", ""),
-            ),
-        )
-    conn.commit()
-    conn.close()
+    # A restore that dies half-way is simply run again, so skip fsyncs for the bulk load.
+    # Only possible outside a transaction; journal_mode stays WAL because leaving it needs
+    # exclusive access, which other threads' open connections would block.
+    bulk = not conn.in_transaction
+    if bulk:
+        conn.execute("PRAGMA synchronous=OFF")
+    try:
+        with transaction():
+            _after_transaction(_invalidate_history_cache)
+            _after_transaction(_invalidate_config_cache)
+            cur = conn.cursor()
+            cur.execute("DELETE FROM requests")
+            cur.execute("DELETE FROM schedules")
+            cur.execute("DELETE FROM travel")
+            cur.execute("DELETE FROM config")
+            cur.execute("DELETE FROM config_history")
+
+            cur.executemany(
+                _SQL_INSERT_REQUEST,
+                (
+                    (r.get("month", ""), r.get("doctor", ""), r.get("request_text", ""), r.get("created_at", ""))
+                    for r in data.get("requests", [])
+                ),
+            )
+            # Older backups may hold several rows per (month, status); keep the first of each,
+            # as init_db does, so the unique index doesn't reject the whole restore
+            schedules: Dict[Tuple[str, str], Tuple[str, str, str, str, str, str]] = {}
+            for s in data.get("schedules", []):
+                row = (
+                    s.get("month", ""),
+                    s.get("status", "draft"),
+                    s.get("table_text", ""),
+                    s.get("counts_text", ""),
+                    s.get("change_log", ""),
+                    s.get("created_at", ""),
+                )
+                schedules.setdefault(row[:2], row)
+            skipped = len(data.get("schedules", [])) - len(schedules)
+            if skipped:
+                logger.warning("Skipped %d duplicate schedule rows (same month and status) in restore", skipped)
+            cur.executemany(_SQL_INSERT_SCHEDULE, schedules.values())
+            cur.executemany(
+                _SQL_INSERT_TRAVEL,
+                (
+                    (
+                        t.get("month", ""),
+                        t.get("doctor", ""),
+                        t.get("days"),
+                        t.get("dates_text"),
+                        t.get("created_at", ""),
+                    )
+                    for t in data.get("travel", [])
+                ),
+            )
+            cur.executemany(
+                _SQL_INSERT_CONFIG,
+                ((c.get("key", ""), c.get("value", "")) for c in data.get("config", [])),
+            )
+            cur.executemany(
+                _SQL_INSERT_CONFIG_HISTORY,
+                (
+                    (
+                        h.get("created_at", ""),
+                        h.get("editor", ""),
+                        h.get("staff_list", ""),
+                        h.get("base_rules", ""),
+                        h.get("individual_rules", ""),
+                        h.get("additional_rules", ""),
+                    )
+                    for h in data.get("config_history", [])
+                ),
+            )
+    finally:
+        if bulk:
+            conn.execute("PRAGMA synchronous=NORMAL")
@@ -1,8 +1,12 @@
 from __future__ import annotations
 from datetime import datetime
-import json
+from functools import lru_cache
+from typing import Any, Mapping, Sequence
+import csv
+import io
+import orjson
 from fastapi import FastAPI, Form, Request, UploadFile, File
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 
@@ -11,7 +15,9 @@ from .db import (
     init_db,
     add_request,
     list_requests,
+    iter_requests,
     list_requests_by_doctor,
+    travel_counts_from_requests,
     delete_request,
     upsert_travel,
     list_travel,
@@ -21,12 +27,13 @@ from .db import (
     add_config_history,
     list_config_history,
     upsert_schedule,
-    get_schedule,
-    get_latest_schedule,
-    export_all,
+    get_schedules_for_month,
+    get_display_schedule,
+    iter_export,
     restore_all,
+    transaction,
 )
-from .scheduler import generate_schedule, render_table, render_counts, counts_from_table
+from .scheduler import generate_schedule, render_table, render_counts, counts_from_table, parse_counts_totals
 
 app = FastAPI(title=APP_NAME)
 
@@ -34,6 +41,8 @@ app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 templates = Jinja2Templates(directory="app/templates")
 
+STREAM_CHUNK_SIZE = 64 * 1024
+
 
 @app.on_event("startup")
 def on_startup() -> None:
@@ -44,10 +53,21 @@ def now_str() -> str:
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
 
+def _counts_json(counts_text: str) -> str:
+    # Per-person totals stored next to counts_text so /view doesn't re-parse the CSV
+    return orjson.dumps(parse_counts_totals(counts_text)).decode()
+
+
 def get_month_choices() -> list[str]:
     today = datetime.now()
-    y = today.year
-    m = today.month + 1
+    return _month_choices(today.year, today.month)
+
+
+@lru_cache(maxsize=4)
+def _month_choices(year: int, month: int) -> list[str]:
+    # Cached and shared between requests; callers only read it
+    y = year
+    m = month + 1
     choices = []
     for i in range(3):
         mm = m + i
@@ -57,25 +77,36 @@ def get_month_choices() -> list[str]:
     return choices
 
 
+# (stored, parsed) pair; parsed is reused for as long as get_config_map() returns the same cached dict
+_parsed_config_cache: dict = {"entry": (None, None)}
+
+_DEFAULT_STAFF_LIST = ",".join(STAFF_LIST)
+_DEFAULT_BASE_RULES = "\n".join(BASE_RULES)
+_DEFAULT_INDIVIDUAL_RULES = "\n".join(INDIVIDUAL_RULES)
+_DEFAULT_ADDITIONAL_RULES = "\n".join(ADDITIONAL_RULES)
+
+
+def _non_empty(items: list[str]) -> list[str]:
+    return [s for s in (p.strip() for p in items) if s]
+
+
 def load_config() -> dict:
     stored = get_config_map()
-    staff_list = stored.get("staff_list", ",".join(STAFF_LIST)).split(",")
-    base_rules = stored.get("base_rules", "\n".join(BASE_RULES)).splitlines()
-    individual_rules = stored.get("individual_rules", "\n".join(INDIVIDUAL_RULES)).splitlines()
-    additional_rules = stored.get("additional_rules", "\n".join(ADDITIONAL_RULES)).splitlines()
-    staff_list = [s.strip() for s in staff_list if s.strip()]
-    base_rules = [s.strip() for s in base_rules if s.strip()]
-    individual_rules = [s.strip() for s in individual_rules if s.strip()]
-    additional_rules = [s.strip() for s in additional_rules if s.strip()]
-    return {
-        "staff_list": staff_list,
-        "base_rules": base_rules,
-        "individual_rules": individual_rules,
-        "additional_rules": additional_rules,
+    cached_stored, cached_cfg = _parsed_config_cache["entry"]
+    if stored is cached_stored:
+        return cached_cfg
+    cfg = {
+        "staff_list": _non_empty(stored.get("staff_list", _DEFAULT_STAFF_LIST).split(",")),
+        "base_rules": _non_empty(stored.get("base_rules", _DEFAULT_BASE_RULES).splitlines()),
+        "individual_rules": _non_empty(stored.get("individual_rules", _DEFAULT_INDIVIDUAL_RULES).splitlines()),
+        "additional_rules": _non_empty(stored.get("additional_rules", _DEFAULT_ADDITIONAL_RULES).splitlines()),
     }
+    _parsed_config_cache["entry"] = (stored, cfg)
+    return cfg
 
 
-def build_prompt(month: str, requests: list[dict], cfg: dict) -> str:
+def build_prompt(month: str, requests: Sequence[Mapping[str, Any]], cfg: dict) -> str:
+    # requests: rows from list_requests; "doctor" and "request_text" are required
     lines: list[str] = []
     lines.append("【対象月】")
     lines.append(month)
@@ -106,8 +137,8 @@ def build_prompt(month: str, requests: list[dict], cfg: dict) -> str:
     travel_rows = list_travel(month)
     if travel_rows:
         for t in travel_rows:
-            day_part = f"{t['days']}日" if t.get("days") is not None else "未入力"
-            date_part = t.get("dates_text") or "未入力"
+            day_part = f"{t['days']}日" if t["days"] is not None else "未入力"
+            date_part = t["dates_text"] or "未入力"
             lines.append(f"{t['doctor']}：日数={day_part}、日付={date_part}")
     else:
         lines.append("（まだ登録されていません）")
@@ -210,8 +241,9 @@ def admin_page(request: Request, month: str | None = None):
     month_choices = get_month_choices()
     reqs = list_requests(month_value) if month_value else []
     prompt = build_prompt(month_value, reqs, cfg) if month_value else ""
-    draft = get_schedule(month_value, "draft") if month_value else None
-    final = get_schedule(month_value, "final") if month_value else None
+    schedules = get_schedules_for_month(month_value) if month_value else {}
+    draft = schedules.get("draft")
+    final = schedules.get("final")
     travel_rows = list_travel(month_value) if month_value else []
     submitted = {r["doctor"] for r in reqs}
     missing = [name for name in cfg["staff_list"] if name not in submitted]
@@ -243,33 +275,58 @@ def admin_page(request: Request, month: str | None = None):
 
 @app.get("/admin/export.csv")
 def export_requests_csv(month: str):
-    reqs = list_requests(month)
-    lines = ["月,氏名,希望"]
-    for r in reqs:
-        text = r.get("request_text", "").replace("\n", " ")
-        lines.append(f"{month},{r['doctor']},{text}")
-    content = "\n".join(lines)
-    return HTMLResponse(content=content, media_type="text/csv; charset=utf-8")
-
-
+    def generate():
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["月", "氏名", "希望"])
+        for r in iter_requests(month):
+            writer.writerow([month, r["doctor"], r["request_text"].replace("\n", " ")])
+            # Each chunk costs a threadpool round-trip, so send rows in batches
+            if buf.tell() >= STREAM_CHUNK_SIZE:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        yield buf.getvalue()
+
+    return StreamingResponse(generate(), media_type="text/csv; charset=utf-8")
+
+
+# Plain def on purpose: FastAPI runs the handler, and Starlette iterates the sync
+# generator, in its threadpool, so SQLite and json work never blocks the event loop
 @app.get("/admin/backup.json")
 def export_backup():
-    payload = {
-        "version": 1,
-        "exported_at": now_str(),
-        "data": export_all(),
-    }
-    content = json.dumps(payload, ensure_ascii=False, indent=2)
+    def generate():
+        parts = [b'{"version":1,"exported_at":', orjson.dumps(now_str()), b',"data":{']
+        size = 0
+        for i, (name, rows) in enumerate(iter_export()):
+            if i:
+                parts.append(b",")
+            parts.append(orjson.dumps(name) + b":[")
+            for j, r in enumerate(rows):
+                if j:
+                    parts.append(b",")
+                data = orjson.dumps(dict(r))
+                parts.append(data)
+                size += len(data)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield b"".join(parts)
+                    parts.clear()
+                    size = 0
+            parts.append(b"]")
+        parts.append(b"}}")
+        yield b"".join(parts)
+
     filename = f"och-shiftkun-backup-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
     headers = {"Content-Disposition": f"attachment; filename={filename}"}
-    return Response(content=content, media_type="application/json; charset=utf-8", headers=headers)
+    return StreamingResponse(generate(), media_type="application/json; charset=utf-8", headers=headers)
 
 
+# Plain def on purpose (see export_backup): parsing and restore_all run in the threadpool
 @app.post("/admin/restore")
 def restore_backup(file: UploadFile = File(...)):
     try:
         raw = file.file.read()
-        payload = json.loads(raw.decode("utf-8"))
+        payload = orjson.loads(raw)
         data = payload.get("data", payload)
         if not isinstance(data, dict):
             raise ValueError("invalid payload")
@@ -312,6 +369,7 @@ def generate_schedule_action(month: str = Form(...)):
         counts_text=counts_text,
         change_log="自動生成（下書き）",
         created_at=now_str(),
+        counts_json=_counts_json(counts_text),
     )
     return RedirectResponse(url=f"/admin?month={month_value}", status_code=303)
 
@@ -346,22 +404,24 @@ def save_config(
         return RedirectResponse(url=f"/admin?month={month}&config_error=editor_empty", status_code=303)
 
     current = load_config()
-    add_config_history(
-        staff_list=",".join(current["staff_list"]),
-        base_rules="\n".join(current["base_rules"]),
-        individual_rules="\n".join(current["individual_rules"]),
-        additional_rules="\n".join(current["additional_rules"]),
-        created_at=now_str(),
-        editor=editor.strip(),
-    )
-    set_config_map(
-        {
-            "staff_list": ",".join(staff_items),
-            "base_rules": base_raw,
-            "individual_rules": indiv_raw,
-            "additional_rules": add_raw,
-        }
-    )
+    # History entry and new config are committed together
+    with transaction():
+        add_config_history(
+            staff_list=",".join(current["staff_list"]),
+            base_rules="\n".join(current["base_rules"]),
+            individual_rules="\n".join(current["individual_rules"]),
+            additional_rules="\n".join(current["additional_rules"]),
+            created_at=now_str(),
+            editor=editor.strip(),
+        )
+        set_config_map(
+            {
+                "staff_list": ",".join(staff_items),
+                "base_rules": base_raw,
+                "individual_rules": indiv_raw,
+                "additional_rules": add_raw,
+            }
+        )
     return RedirectResponse(url=f"/admin?month={month}", status_code=303)
 
 
@@ -389,6 +449,7 @@ def save_schedule(
         counts_text=counts_value,
         change_log=change_log.strip(),
         created_at=now_str(),
+        counts_json=_counts_json(counts_value),
     )
     return RedirectResponse(url=f"/admin?month={month_value}", status_code=303)
 
@@ -399,33 +460,21 @@ def view_page(request: Request, month: str | None = None):
     month_choices = get_month_choices()
     schedule = None
     if month_value:
-        schedule = get_schedule(month_value, "final") or get_latest_schedule(month_value)
+        schedule = get_display_schedule(month_value)
     travel_rows = list_travel(month_value) if month_value else []
-    travel_map = {t["doctor"]: (t.get("days") or 0) for t in travel_rows}
+    travel_map = {t["doctor"]: (t["days"] or 0) for t in travel_rows}
     if month_value and not travel_rows:
         # Fallback: derive travel count from requests if travel table is unused
-        reqs = list_requests(month_value)
-        for r in reqs:
-            text = r.get("request_text", "")
-            # Ignore notes after separator
-            if "/ 備考:" in text:
-                text = text.split("/ 備考:", 1)[0]
-            count = text.count("出張")
-            travel_map[r["doctor"]] = travel_map.get(r["doctor"], 0) + count
+        travel_map = travel_counts_from_requests(month_value)
     counts_with_travel = []
     if schedule and schedule.get("counts_text"):
-        lines = [l.strip() for l in schedule["counts_text"].splitlines() if l.strip()]
-        for line in lines:
-            if line.startswith("医師") or line.startswith("医者") or line.startswith("スタッフ"):
-                continue
-            parts = [p.strip() for p in line.split(",")]
-            if len(parts) < 6:
-                continue
-            name = parts[0]
-            try:
-                total = int(parts[5])
-            except ValueError:
-                continue
+        if schedule.get("counts_json"):
+            totals = orjson.loads(schedule["counts_json"])
+        else:
+            totals = parse_counts_totals(schedule["counts_text"])
+        for row in totals:
+            name = row["doctor"]
+            total = row["total"]
             travel_days = int(travel_map.get(name, 0))
             counts_with_travel.append(
                 {
@@ -3,7 +3,8 @@ import re
 import calendar
 from dataclasses import dataclass
 from datetime import date
-from typing import Dict, List, Optional, Set, Tuple
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Sequence, Set, Tuple
 
 SHIFT_LABELS = {
     "E": "早番",
@@ -13,6 +14,34 @@ SHIFT_LABELS = {
 }
 
 SHIFT_KEYS = ["E", "D", "S", "N"]
+SHIFT_INDEX = {key: k for k, key in enumerate(SHIFT_KEYS)}
+SHIFT_S = SHIFT_INDEX["S"]
+SHIFT_N = SHIFT_INDEX["N"]
+NO_SHIFT = -1
+
+WEEKDAY_NAMES = ("月", "火", "水", "木", "金", "土", "日")
+
+_MONTH_RE = re.compile(r"(\d{4})\s*年\s*(\d{1,2})\s*月")
+_TOKEN_SPLIT_RE = re.compile(r"[\n、,;]")
+_DAY_SLASH_RE = re.compile(r"(\d{1,2})\s*/\s*(\d{1,2})")
+_DAY_JP_RE = re.compile(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日")
+_DAY_SUFFIX_RE = re.compile(r"(\d{1,2})\s*日")
+_DAY_LEAD_RE = re.compile(r"^(\d{1,2})\b")
+_WEEKLY_RE = re.compile(r"週\s*(\d+)\s*回")
+
+# parse_allowed_shifts bitmask (bit k = SHIFT_KEYS[k]) -> shift keys
+_SHIFTS_BY_BITS = [frozenset(key for k, key in enumerate(SHIFT_KEYS) if bits >> k & 1) for bits in range(16)]
+_ONLY_WORDS = (("早番のみ", 1), ("日勤のみ", 2), ("準夜のみ", 4), ("夜勤のみ", 8))
+
+# Shifts filled per day as SHIFT_KEYS indexes in assignment order (nights, then early, then
+# day, then evening). Weekends and holidays have no day shift; generate_schedule picks one
+# of these per day.
+_WEEKDAY_REQUIRED = [SHIFT_INDEX[s] for s in ["N", "E", "D", "S"]]
+_HOLIDAY_REQUIRED = [SHIFT_INDEX[s] for s in ["N", "E", "S"]]
+
+# Shifts still allowed the day after an evening / night shift
+_AFTER_S_BITS = 1 << SHIFT_S | 1 << SHIFT_N
+_AFTER_N_BITS = 1 << SHIFT_N
 
 
 @dataclass
@@ -22,8 +51,9 @@ class PersonRule:
     weekly_max: Optional[int] = None
 
 
+@lru_cache(maxsize=32)
 def parse_month(month_text: str) -> Tuple[int, int]:
-    m = re.search(r"(\d{4})\s*年\s*(\d{1,2})\s*月", month_text)
+    m = _MONTH_RE.search(month_text)
     if not m:
         raise ValueError("対象月の形式が不正です。例: 2026年4月")
     return int(m.group(1)), int(m.group(2))
@@ -33,78 +63,79 @@ def month_days(year: int, month: int) -> int:
     return calendar.monthrange(year, month)[1]
 
 
-def is_weekend(d: date) -> bool:
-    return d.weekday() >= 5
+def month_calendar(year: int, month: int) -> Tuple[List[int], List[int]]:
+    # (weekday, ISO week) for each day of the month, derived from day 1 without building
+    # a date per day (index 0 is unused so days index directly)
+    first = date(year, month, 1)
+    wd0 = first.weekday()
+    week = first.isocalendar()[1]
+    last_week = date(year, 12, 28).isocalendar()[1]
+    weekday_of_day = [0]
+    week_of_day = [0]
+    for day in range(1, month_days(year, month) + 1):
+        weekday = (wd0 + day - 1) % 7
+        if day > 1 and weekday == 0:
+            # January starts in the previous year's last week; December may end in week 1
+            week = 1 if week >= 52 and (month == 1 or week == last_week) else week + 1
+        weekday_of_day.append(weekday)
+        week_of_day.append(week)
+    return weekday_of_day, week_of_day
 
 
 def split_tokens(text: str) -> List[str]:
-    parts = re.split(r"[\n、,;]", text)
+    parts = _TOKEN_SPLIT_RE.split(text)
     return [p.strip() for p in parts if p.strip()]
 
 
 def extract_day(token: str) -> Optional[int]:
     # Accept formats: 4/12, 4月12日, 12日, 12
-    m = re.search(r"(\d{1,2})\s*/\s*(\d{1,2})", token)
+    m = _DAY_SLASH_RE.search(token)
     if m:
         return int(m.group(2))
-    m = re.search(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日", token)
+    m = _DAY_JP_RE.search(token)
     if m:
         return int(m.group(2))
-    m = re.search(r"(\d{1,2})\s*日", token)
+    m = _DAY_SUFFIX_RE.search(token)
     if m:
         return int(m.group(1))
-    m = re.match(r"^(\d{1,2})\b", token)
+    m = _DAY_LEAD_RE.match(token)
     if m:
         return int(m.group(1))
     return None
 
 
 def parse_allowed_shifts(token: str) -> Optional[Set[str]]:
-    token = token.replace("　", " ")
-    token = token.replace("／", "/")
-    allowed: Set[str] = set()
-
-    if "休み" in token or "年休" in token or "×" in token:
-        # If only休み/年休 specified, treat as off (None)
-        # If combined with shifts, we keep shift choices (user expects OR)
-        if any(k in token for k in ["早番", "日勤", "準夜", "夜勤", "○", "ー", "☆", "●"]):
-            pass
-        else:
+    # Bit k stands for SHIFT_KEYS[k]
+    bits = (
+        ("早番" in token or "○" in token)
+        | ("日勤" in token or "ー" in token) << 1
+        | ("準夜" in token or "☆" in token) << 2
+        | ("夜勤" in token or "●" in token) << 3
+    )
+
+    if not bits:
+        # 休み/年休/×/出張 treated as off; combined with shifts we keep the
+        # shift choices (user expects OR)
+        if "休み" in token or "年休" in token or "×" in token or "出張" in token:
             return set()
+        return None
 
-    if "出張" in token:
-        # treat as off for scheduling
-        if any(k in token for k in ["早番", "日勤", "準夜", "夜勤", "○", "ー", "☆", "●"]):
-            pass
-        else:
-            return set()
-
-    if "早番" in token or "○" in token:
-        allowed.add("E")
-    if "日勤" in token or "ー" in token:
-        allowed.add("D")
-    if "準夜" in token or "☆" in token:
-        allowed.add("S")
-    if "夜勤" in token or "●" in token:
-        allowed.add("N")
-
-    if "早番のみ" in token:
-        return {"E"}
-    if "日勤のみ" in token:
-        return {"D"}
-    if "準夜のみ" in token:
-        return {"S"}
-    if "夜勤のみ" in token:
-        return {"N"}
+    if "のみ" in token:
+        for word, only in _ONLY_WORDS:
+            if word in token:
+                return set(_SHIFTS_BY_BITS[only])
 
-    return allowed if allowed else None
+    return set(_SHIFTS_BY_BITS[bits])
 
 
-def parse_requests(month_text: str, requests: List[dict]) -> Dict[str, Dict[int, Optional[Set[str]]]]:
+def parse_requests(
+    month_text: str, requests: Sequence[Mapping[str, Any]]
+) -> Dict[str, Dict[int, Optional[Set[str]]]]:
+    # Each request needs "doctor" and "request_text" keys (dicts or sqlite3.Row from list_requests)
     allowed_map: Dict[str, Dict[int, Optional[Set[str]]]] = {}
     for r in requests:
         doctor = r["doctor"]
-        text = r.get("request_text", "")
+        text = r["request_text"]
         if "/ 備考:" in text:
             text = text.split("/ 備考:", 1)[0]
         allowed_map.setdefault(doctor, {})
@@ -135,7 +166,7 @@ def parse_individual_rules(lines: List[str], staff_list: List[str]) -> Dict[str,
             rule = rules[name]
             if "土日" in line and "休" in line:
                 rule.weekend_off = True
-            m = re.search(r"週\s*(\d+)\s*回", line)
+            m = _WEEKLY_RE.search(line)
             if m:
                 rule.weekly_max = int(m.group(1))
             if "早番/日勤のみ" in line or "早番もしくは日勤のみ" in line:
@@ -167,189 +198,250 @@ HOLIDAYS_2026 = {
 }
 
 
-def is_holiday(d: date) -> bool:
-    if d.year == 2026:
-        return d in HOLIDAYS_2026
-    return False
+@lru_cache(maxsize=None)
+def _month_holidays(year: int, month: int) -> FrozenSet[int]:
+    return frozenset(h.day for h in HOLIDAYS_2026 if h.year == year and h.month == month)
 
 
-def weekday_shifts(d: date) -> List[str]:
-    if is_weekend(d) or is_holiday(d):
-        return ["E", "S", "N"]
-    return ["E", "D", "S", "N"]
+def shift_bits(shifts: Set[str]) -> int:
+    # Bitmask over SHIFT_KEYS (bit k = SHIFT_KEYS[k]) of the given shift keys
+    bits = 0
+    for k, key in enumerate(SHIFT_KEYS):
+        if key in shifts:
+            bits |= 1 << k
+    return bits
 
 
-def can_assign(
-    name: str,
-    shift: str,
-    day: int,
-    d: date,
+def build_allowed_mask(
+    weekday_of_day: List[int],
+    staff_list: List[str],
     allowed_map: Dict[str, Dict[int, Optional[Set[str]]]],
     rules: Dict[str, PersonRule],
-    last_shift: Dict[str, Optional[str]],
-    cons_work: Dict[str, int],
-    cons_shift: Dict[str, int],
-    weekly_count: Dict[Tuple[str, int], int],
-) -> bool:
-    # Availability
-    if name in allowed_map and day in allowed_map[name]:
-        allowed = allowed_map[name][day]
-        if allowed is not None and shift not in allowed:
-            return False
-        if allowed is not None and len(allowed) == 0:
-            return False
-    # Personal rules
-    rule = rules.get(name, PersonRule())
-    if rule.weekend_off and is_weekend(d):
-        return False
-    if rule.allowed_shifts and shift not in rule.allowed_shifts:
-        return False
+) -> List[List[int]]:
+    # mask[day][i]: bitmask (bit k = SHIFT_KEYS[k]) of the shifts staff_list[i] may work on
+    # day as far as requests and personal rules go (index 0 is unused so days index directly)
+    days = len(weekday_of_day) - 1
+    all_bits = (1 << len(SHIFT_KEYS)) - 1
+    default_rule = PersonRule()
+    columns: List[List[int]] = []
+    for name in staff_list:
+        rule = rules.get(name, default_rule)
+        rule_bits = shift_bits(rule.allowed_shifts) if rule.allowed_shifts else all_bits
+        column = [rule_bits] * (days + 1)
+        for day, requested in allowed_map.get(name, {}).items():
+            if 1 <= day <= days and requested is not None:
+                column[day] = rule_bits & shift_bits(requested)
+        if rule.weekend_off:
+            for day in range(1, days + 1):
+                if weekday_of_day[day] >= 5:
+                    column[day] = 0
+        columns.append(column)
+    if not columns:
+        return [[] for _ in weekday_of_day]
+    return [list(row) for row in zip(*columns)]
+
+
+def feasible_shifts(
+    i: int,
+    week: int,
+    allowed: int,
+    weekly_max: Optional[int],
+    last_shift: List[int],
+    cons_work: List[int],
+    cons_shift: List[int],
+    weekly_count: List[List[int]],
+) -> int:
+    # Bitmask of the shifts staff i can take today, starting from the availability and
+    # personal rules precomputed in build_allowed_mask
+    if not allowed:
+        return 0
 
     # Consecutive work days
-    if cons_work.get(name, 0) >= 5:
-        return False
+    if cons_work[i] >= 5:
+        return 0
+
+    # Weekly max
+    if weekly_max is not None and weekly_count[i][week] >= weekly_max:
+        return 0
 
     # After shift constraints
-    prev = last_shift.get(name)
-    if prev == "S" and shift not in {"S", "N"}:
-        return False
-    if prev == "N" and shift != "N":
-        return False
+    prev = last_shift[i]
+    if prev == SHIFT_S:
+        allowed &= _AFTER_S_BITS
+    elif prev == SHIFT_N:
+        allowed &= _AFTER_N_BITS
 
     # Consecutive shift limits
-    if shift == prev and cons_shift.get(name, 0) >= 2:
-        return False
-
-    # Weekly max
-    if rule.weekly_max is not None:
-        week_key = (name, d.isocalendar().week)
-        if weekly_count.get(week_key, 0) >= rule.weekly_max:
-            return False
-
-    return True
-
-
-def score_candidate(
-    name: str,
-    shift: str,
-    total_count: Dict[str, int],
-    shift_count: Dict[Tuple[str, str], int],
-    cons_work: Dict[str, int],
-    last_shift: Dict[str, Optional[str]],
-) -> float:
-    score = 0.0
-    score += total_count.get(name, 0)
-    score += 0.8 * shift_count.get((name, shift), 0)
-    if last_shift.get(name) == shift:
-        score += 1.5
-    score += 0.3 * cons_work.get(name, 0)
-    return score
+    if prev != NO_SHIFT and cons_shift[i] >= 2:
+        allowed &= ~(1 << prev)
+
+    return allowed
+
+
+def score_candidates(
+    candidates: List[int],
+    shift: int,
+    total_count: List[int],
+    shift_count: List[List[int]],
+    cons_work: List[int],
+    last_shift: List[int],
+) -> List[float]:
+    # Lower is better; terms are summed in the same order for every candidate so equal
+    # scores compare equal
+    return [
+        total_count[i] + 0.8 * shift_count[i][shift] + (1.5 if last_shift[i] == shift else 0.0) + 0.3 * cons_work[i]
+        for i in candidates
+    ]
+
+
+def _assign_day(
+    week: int,
+    required: List[int],
+    allowed_today: List[int],
+    weekly_max: List[Optional[int]],
+    last_shift: List[int],
+    cons_work: List[int],
+    cons_shift: List[int],
+    total_count: List[int],
+    shift_count: List[List[int]],
+    weekly_count: List[List[int]],
+) -> List[int]:
+    # Staff index picked for each shift in required (NO_SHIFT when nobody fits)
+    n = len(allowed_today)
+    feas = [
+        feasible_shifts(i, week, allowed_today[i], weekly_max[i], last_shift, cons_work, cons_shift, weekly_count)
+        for i in range(n)
+    ]
+    picked: List[int] = []
+    for k in required:
+        bit = 1 << k
+        candidates = [i for i in range(n) if feas[i] & bit]
+        if not candidates:
+            picked.append(NO_SHIFT)
+            continue
+        if len(candidates) == 1:
+            best = candidates[0]
+        else:
+            # Scores are never negative and only someone with no shifts yet scores 0, so the
+            # first such candidate is the pick without scoring the rest
+            for best in candidates:
+                if not total_count[best]:
+                    break
+            else:
+                scores = score_candidates(candidates, k, total_count, shift_count, cons_work, last_shift)
+                # index() finds the first minimum, so ties go to the earliest staff index
+                best = candidates[scores.index(min(scores))]
+        # One shift per person per day
+        feas[best] = 0
+        picked.append(best)
+    return picked
 
 
 def generate_schedule(
     month_text: str,
     staff_list: List[str],
-    requests: List[dict],
+    requests: Sequence[Mapping[str, Any]],
     individual_rules: List[str],
 ) -> Tuple[Dict[int, Dict[str, str]], Dict[str, Dict[str, int]]]:
     year, month = parse_month(month_text)
     days = month_days(year, month)
     allowed_map = parse_requests(month_text, requests)
     rules = parse_individual_rules(individual_rules, staff_list)
-
+    # Per-person state as parallel lists indexed like staff; shifts are SHIFT_KEYS indexes.
+    # Repeated names share one slot, as they did when state was keyed by name, and the
+    # daily update still runs once per occurrence in staff_list.
+    staff = list(dict.fromkeys(staff_list))
+    slot = {name: i for i, name in enumerate(staff)}
+    occurrences = [slot[name] for name in staff_list]
+    weekday_of_day, week_of_day = month_calendar(year, month)
+    allowed_mask = build_allowed_mask(weekday_of_day, staff, allowed_map, rules)
+    weekly_max = [rules[name].weekly_max for name in staff]
+
+    n = len(staff)
     schedule: Dict[int, Dict[str, str]] = {d: {} for d in range(1, days + 1)}
-    last_shift: Dict[str, Optional[str]] = {s: None for s in staff_list}
-    cons_shift: Dict[str, int] = {s: 0 for s in staff_list}
-    cons_work: Dict[str, int] = {s: 0 for s in staff_list}
-    total_count: Dict[str, int] = {s: 0 for s in staff_list}
-    shift_count: Dict[Tuple[str, str], int] = {}
-    weekly_count: Dict[Tuple[str, int], int] = {}
+    last_shift: List[int] = [NO_SHIFT] * n
+    cons_shift: List[int] = [0] * n
+    cons_work: List[int] = [0] * n
+    total_count: List[int] = [0] * n
+    shift_count: List[List[int]] = [[0] * len(SHIFT_KEYS) for _ in range(n)]
+    # Shifts actually placed in the schedule; unlike shift_count this is not bumped once per
+    # repeat of a name in staff_list
+    assigned_count: List[List[int]] = [[0] * len(SHIFT_KEYS) for _ in range(n)]
+    # weekly_count[i][iso week]; ISO weeks run 1..53
+    weekly_count: List[List[int]] = [[0] * 54 for _ in range(n)]
+
+    # Shifts to fill per day as SHIFT_KEYS indexes, in assignment order
+    # (index 0 is unused so days index directly)
+    holidays = _month_holidays(year, month)
+    required_per_day: List[List[int]] = [[]]
+    for day in range(1, days + 1):
+        if day in holidays or weekday_of_day[day] >= 5:
+            required_per_day.append(_HOLIDAY_REQUIRED)
+        else:
+            required_per_day.append(_WEEKDAY_REQUIRED)
 
     for day in range(1, days + 1):
-        d = date(year, month, day)
-        required = weekday_shifts(d)
-        # prioritize nights, then early, then day, then evening
-        order = ["N", "E", "D", "S"]
-        required_sorted = [s for s in order if s in required]
-
-        assigned_today: Set[str] = set()
-        for shift in required_sorted:
-            candidates = []
-            for name in staff_list:
-                if name in assigned_today:
-                    continue
-                if not can_assign(
-                    name,
-                    shift,
-                    day,
-                    d,
-                    allowed_map,
-                    rules,
-                    last_shift,
-                    cons_work,
-                    cons_shift,
-                    weekly_count,
-                ):
-                    continue
-                candidates.append(name)
-            if not candidates:
-                # Allow S to be empty, N try hard but allow empty
-                schedule[day][shift] = ""
-                continue
-            # choose lowest score
-            best = min(candidates, key=lambda n: score_candidate(n, shift, total_count, shift_count, cons_work, last_shift))
-            schedule[day][shift] = best
-            assigned_today.add(best)
+        week = week_of_day[day]
+        required = required_per_day[day]
+
+        picked = _assign_day(
+            week,
+            required,
+            allowed_mask[day],
+            weekly_max,
+            last_shift,
+            cons_work,
+            cons_shift,
+            total_count,
+            shift_count,
+            weekly_count,
+        )
+        # Shift each staff member works today (NO_SHIFT if off)
+        day_assign = [NO_SHIFT] * n
+        for k, best in zip(required, picked):
+            # Allow S to be empty, N try hard but allow empty
+            if best == NO_SHIFT:
+                schedule[day][SHIFT_KEYS[k]] = ""
+            else:
+                schedule[day][SHIFT_KEYS[k]] = staff[best]
+                day_assign[best] = k
+                assigned_count[best][k] += 1
 
         # Update per-person state after day assigned
-        for name in staff_list:
-            # Check if worked today
-            worked_shift = None
-            for sh in required_sorted:
-                if schedule[day].get(sh) == name:
-                    worked_shift = sh
-                    break
-            if worked_shift:
-                total_count[name] += 1
-                shift_count[(name, worked_shift)] = shift_count.get((name, worked_shift), 0) + 1
-                week_key = (name, d.isocalendar().week)
-                weekly_count[week_key] = weekly_count.get(week_key, 0) + 1
-
-                if last_shift.get(name) == worked_shift:
-                    cons_shift[name] = cons_shift.get(name, 0) + 1
+        for i in occurrences:
+            worked_shift = day_assign[i]
+            if worked_shift != NO_SHIFT:
+                total_count[i] += 1
+                shift_count[i][worked_shift] += 1
+                weekly_count[i][week] += 1
+
+                if last_shift[i] == worked_shift:
+                    cons_shift[i] += 1
                 else:
-                    cons_shift[name] = 1
-                last_shift[name] = worked_shift
-                cons_work[name] = cons_work.get(name, 0) + 1
+                    cons_shift[i] = 1
+                last_shift[i] = worked_shift
+                cons_work[i] += 1
             else:
-                cons_work[name] = 0
-                cons_shift[name] = 0
-                last_shift[name] = None
+                cons_work[i] = 0
+                cons_shift[i] = 0
+                last_shift[i] = NO_SHIFT
 
     # Build counts
-    counts: Dict[str, Dict[str, int]] = {s: {"E": 0, "D": 0, "S": 0, "N": 0} for s in staff_list}
-    for day in range(1, days + 1):
-        for sh, name in schedule[day].items():
-            if name:
-                counts[name][sh] += 1
+    counts: Dict[str, Dict[str, int]] = {name: dict(zip(SHIFT_KEYS, assigned_count[i])) for i, name in enumerate(staff)}
 
     return schedule, counts
 
 
 def render_table(month_text: str, schedule: Dict[int, Dict[str, str]]) -> str:
     year, month = parse_month(month_text)
-    lines = []
-    lines.append("| 日付 | 曜 | 早番 | 日勤 | 準夜 | 夜勤 |")
-    lines.append("|---|---|---|---|---|---|")
-    for day in sorted(schedule.keys()):
-        d = date(year, month, day)
-        wd = "月火水木金土日"[d.weekday()]
-        e = schedule[day].get("E", "")
-        dsh = schedule[day].get("D", "")
-        s = schedule[day].get("S", "")
-        n = schedule[day].get("N", "")
-        lines.append(f"| {month}/{day} | {wd} | {e} | {dsh} | {s} | {n} |")
-    return "\n".join(lines)
+    wd0 = date(year, month, 1).weekday()
+    header = ["| 日付 | 曜 | 早番 | 日勤 | 準夜 | 夜勤 |", "|---|---|---|---|---|---|"]
+    rows = [
+        f"| {month}/{day} | {WEEKDAY_NAMES[(wd0 + day - 1) % 7]} | {row.get('E', '')} | {row.get('D', '')}"
+        f" | {row.get('S', '')} | {row.get('N', '')} |"
+        for day, row in sorted(schedule.items())
+    ]
+    return "\n".join(header + rows)
 
 
 def render_counts(counts: Dict[str, Dict[str, int]]) -> str:
@@ -360,24 +452,42 @@ def render_counts(counts: Dict[str, Dict[str, int]]) -> str:
     return "\n".join(lines)
 
 
+def parse_counts_totals(counts_text: str) -> List[Dict[str, Any]]:
+    # Reads the per-person total back out of render_counts-style CSV
+    totals: List[Dict[str, Any]] = []
+    for line in counts_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("医師") or line.startswith("医者") or line.startswith("スタッフ"):
+            continue
+        parts = [p.strip() for p in line.split(",")]
+        if len(parts) < 6:
+            continue
+        try:
+            total = int(parts[5])
+        except ValueError:
+            continue
+        totals.append({"doctor": parts[0], "total": total})
+    return totals
+
+
 def counts_from_table(table_text: str) -> Dict[str, Dict[str, int]]:
-    counts: Dict[str, Dict[str, int]] = {}
+    # Per-person tallies indexed like SHIFT_KEYS, in first-seen order
+    tallies: Dict[str, List[int]] = {}
     for line in table_text.splitlines():
         if "|" not in line:
             continue
-        parts = [p.strip() for p in line.split("|") if p.strip()]
-        if not parts:
-            continue
+        parts = [p for p in map(str.strip, line.split("|")) if p]
         # Skip header/separator
-        if parts[0] in {"日付", "---"}:
-            continue
-        if len(parts) < 6:
+        if len(parts) < 6 or parts[0] == "日付" or parts[0] == "---":
             continue
         # Expected: 日付, 曜, 早番, 日勤, 準夜, 夜勤
-        e, d, s, n = parts[2], parts[3], parts[4], parts[5]
-        for name, key in [(e, "E"), (d, "D"), (s, "S"), (n, "N")]:
-            if not name or name in {"欠員", "空欄"}:
+        for k, name in enumerate(parts[2:6]):
+            if name == "欠員" or name == "空欄":
                 continue
-            counts.setdefault(name, {"E": 0, "D": 0, "S": 0, "N": 0})
-            counts[name][key] += 1
-    return counts
+            tally = tallies.get(name)
+            if tally is None:
+                tally = tallies[name] = [0, 0, 0, 0]
+            tally[k] += 1
+    return {name: dict(zip(SHIFT_KEYS, tally)) for name, tally in tallies.items()}